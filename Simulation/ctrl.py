@@ -14,14 +14,19 @@ Please feel free to use and modify this, but keep the above information. Thanks!
 
 import numpy as np
 from numpy import pi
-from numpy import sin, cos, tan, sqrt
-from numpy.linalg import norm
+from math import atan2, copysign
 import utils
 import config
+import ctrl_numba
 
 rad2deg = 180.0/pi
 deg2rad = pi/180.0
 
+# Explicit scalar norms: np.linalg.norm on a 3-vector is dominated by
+# asarray/ravel/ufunc dispatch overhead
+def _norm3(v):
+    return (v[0]*v[0] + v[1]*v[1] + v[2]*v[2])**0.5
+
 # Set PID Gains and Max Values
 # ---------------------------
 
@@ -80,10 +85,17 @@ class Control:
     
     def __init__(self, quad, yawType, params=params):
 
+        # config.orient is constant for a run; cache the comparison once
+        # instead of re-evaluating it on every controller call
+        self.orient_ned = (config.orient == "NED")
+
         self.saturateVel_separately = params["saturateVel_separately"]
 
-        # Max tilt
+        # Max tilt (tangent precomputed for the thrust saturation in
+        # xy_vel_control, together with the squared thrust limit)
         self.tiltMax = params["tiltMax"]*deg2rad
+        self.tan_tiltMax = float(np.tan(self.tiltMax))
+        self.maxThr_sq = quad.params["maxThr"]**2
 
         # Max Rate
         self.pMax = params["pMax"]*deg2rad
@@ -120,7 +132,19 @@ class Control:
         self.eul_sp        = np.zeros(3)
         self.pqr_sp        = np.zeros(3)
         self.yawFF         = 0.
-    
+
+        # Dispatch table for the controller cascades, resolved once per
+        # ctrlType instead of re-running the string if/elif every tick
+        self._pipelines = {"xyz_vel"      : self._ctrl_xyz_vel,
+                           "xy_vel_z_pos" : self._ctrl_xy_vel_z_pos,
+                           "xyz_pos"      : self._ctrl_xyz_pos}
+        self._ctrlType = None
+        self._pipeline = None
+
+        # Compile (or load from cache) the numba control kernels now, so the
+        # first call to controller() doesn't pay the JIT cost
+        ctrl_numba.warmup()
+
     def controller(self, traj, quad, potfld, Ts):
 
         # Desired State (Create a copy, hence the [:])
@@ -133,47 +157,61 @@ class Control:
         self.pqr_sp[:]    = traj.sDes[15:18]
         self.yawFF        = traj.sDes[18]
 
-        # Select Controller
+        # Select Controller (the pipeline is refreshed only when the
+        # trajectory's ctrlType changes)
         # ---------------------------
-        if (traj.ctrlType == "xyz_vel"):
-            self.saturateVel()
-            self.z_vel_control(quad, potfld, Ts)
-            self.xy_vel_control(quad, potfld, Ts)
-            self.thrustToAttitude(quad, potfld, Ts)
-            self.attitude_control(quad, Ts)
-            self.rate_control(quad, Ts)
-        elif (traj.ctrlType == "xy_vel_z_pos"):
-            self.z_pos_control(quad, potfld, Ts)
-            self.saturateVel()
-            self.z_vel_control(quad, potfld, Ts)
-            self.xy_vel_control(quad, potfld, Ts)
-            self.thrustToAttitude(quad, potfld, Ts)
-            self.attitude_control(quad, Ts)
-            self.rate_control(quad, Ts)
-        elif (traj.ctrlType == "xyz_pos"):
-            self.z_pos_control(quad, potfld, Ts)
-            self.xy_pos_control(quad, potfld, Ts)
-            self.saturateVel()
-            self.addFrepToVel(potfld)
-            self.saturateVel()
-            self.yaw_follow(traj, Ts)
-            self.z_vel_control(quad, potfld, Ts)
-            self.xy_vel_control(quad, potfld, Ts)
-            self.thrustToAttitude(quad, potfld, Ts)
-            self.attitude_control(quad, Ts)
-            self.rate_control(quad, Ts)
+        if (traj.ctrlType != self._ctrlType):
+            self._ctrlType = traj.ctrlType
+            self._pipeline = self._pipelines[traj.ctrlType]
+        self._pipeline(traj, quad, potfld, Ts)
 
         # Mixer
         # --------------------------- 
-        self.w_cmd = utils.mixerFM(quad, norm(self.thrust_rep_sp), self.rateCtrl)
+        self.w_cmd = utils.mixerFM(quad, _norm3(self.thrust_rep_sp), self.rateCtrl)
         
         # Add calculated Desired States
         # ---------------------------         
-        self.sDesCalc[0:3][:] = self.pos_sp
-        self.sDesCalc[3:6][:] = self.vel_sp
-        self.sDesCalc[6:9][:] = self.thrust_sp
-        self.sDesCalc[9:13][:] = self.qd
-        self.sDesCalc[13:16][:] = self.rate_sp
+        self.sDesCalc[0:3]   = self.pos_sp
+        self.sDesCalc[3:6]   = self.vel_sp
+        self.sDesCalc[6:9]   = self.thrust_sp
+        self.sDesCalc[9:13]  = self.qd
+        self.sDesCalc[13:16] = self.rate_sp
+
+
+    def _ctrl_xyz_vel(self, traj, quad, potfld, Ts):
+
+        self.saturateVel()
+        self.z_vel_control(quad, potfld, Ts)
+        self.xy_vel_control(quad, potfld, Ts)
+        self.thrustToAttitude(quad, potfld, Ts)
+        self.attitude_control(quad, Ts)
+        self.rate_control(quad, Ts)
+
+
+    def _ctrl_xy_vel_z_pos(self, traj, quad, potfld, Ts):
+
+        self.z_pos_control(quad, potfld, Ts)
+        self.saturateVel()
+        self.z_vel_control(quad, potfld, Ts)
+        self.xy_vel_control(quad, potfld, Ts)
+        self.thrustToAttitude(quad, potfld, Ts)
+        self.attitude_control(quad, Ts)
+        self.rate_control(quad, Ts)
+
+
+    def _ctrl_xyz_pos(self, traj, quad, potfld, Ts):
+
+        self.z_pos_control(quad, potfld, Ts)
+        self.xy_pos_control(quad, potfld, Ts)
+        self.saturateVel()
+        self.addFrepToVel(potfld)
+        self.saturateVel()
+        self.yaw_follow(traj, Ts)
+        self.z_vel_control(quad, potfld, Ts)
+        self.xy_vel_control(quad, potfld, Ts)
+        self.thrustToAttitude(quad, potfld, Ts)
+        self.attitude_control(quad, Ts)
+        self.rate_control(quad, Ts)
 
 
     def z_pos_control(self, quad, potfld, Ts):
@@ -195,14 +233,9 @@ class Control:
     def saturateVel(self):
 
         # Saturate Velocity Setpoint
-        # --------------------------- 
-        # Either saturate each velocity axis separately, or total velocity (prefered)
-        if (self.saturateVel_separately):
-            self.vel_sp = np.clip(self.vel_sp, -self.velMax, self.velMax)
-        else:
-            totalVel_sp = norm(self.vel_sp)
-            if (totalVel_sp > self.velMaxAll):
-                self.vel_sp = self.vel_sp/totalVel_sp*self.velMaxAll
+        # ---------------------------
+        ctrl_numba.saturateVel(self.vel_sp, self.velMax, self.velMaxAll,
+                               self.saturateVel_separately)
     
     
     def addFrepToVel(self, potfld):
@@ -217,14 +250,16 @@ class Control:
         # ---------------------------
         # If yawType == "Follow", then set Yaw setpoint and Yaw Rate Feed-Forward to follow the velocity setpoint
         if (traj.yawType == 4 and traj.omit_yaw_follow == 0):
-            totalVel_sp = norm(self.vel_sp)
+            totalVel_sp = _norm3(self.vel_sp)
             if (totalVel_sp > 0.1):
                 # Calculate desired Yaw
-                self.eul_sp[2] = np.arctan2(self.vel_sp[1], self.vel_sp[0])
+                # math.atan2 on plain scalars skips the ufunc dispatch
+                self.eul_sp[2] = atan2(self.vel_sp[1], self.vel_sp[0])
             
-                # Dirty hack, detect when desEul[2] switches from -pi to pi (or vice-versa) and switch manualy current_heading 
-                if (np.sign(self.eul_sp[2]) - np.sign(traj.current_heading) and abs(self.eul_sp[2]-traj.current_heading) >= 2*pi-0.1):
-                    traj.current_heading = traj.current_heading + np.sign(self.eul_sp[2])*2*pi
+                # Dirty hack, detect when desEul[2] switches from -pi to pi (or vice-versa) and switch manualy current_heading
+                # (copysign instead of np.sign: no ufunc dispatch on plain scalars)
+                if (copysign(1.0, self.eul_sp[2]) != copysign(1.0, traj.current_heading) and abs(self.eul_sp[2]-traj.current_heading) >= 2*pi-0.1):
+                    traj.current_heading = traj.current_heading + copysign(2*pi, self.eul_sp[2])
             
                 # Angle between current vector with the next heading vector
                 delta_psi = self.eul_sp[2] - traj.current_heading
@@ -237,69 +272,30 @@ class Control:
 
 
     def z_vel_control(self, quad, potfld, Ts):
-        
+
         # Z Velocity Control (Thrust in D-direction)
         # ---------------------------
-        # Hover thrust (m*g) is sent as a Feed-Forward term, in order to 
-        # allow hover when the position and velocity error are nul
-        vel_z_error = self.vel_sp[2] - quad.vel[2]
-        if (config.orient == "NED"):
-            thrust_z_sp = (self.vel_P_gain[2]*vel_z_error - self.vel_D_gain[2]*quad.vel_dot[2] + 
-                        quad.params["mB"]*(self.acc_sp[2] - quad.params["g"]) + 
-                        self.thr_int[2] + potfld.pfSatFor*potfld.F_rep[2])
-        elif (config.orient == "ENU"):
-            thrust_z_sp = (self.vel_P_gain[2]*vel_z_error - self.vel_D_gain[2]*quad.vel_dot[2] + 
-                        quad.params["mB"]*(self.acc_sp[2] + quad.params["g"]) + 
-                        self.thr_int[2] + potfld.pfSatFor*potfld.F_rep[2])
-        
-        # Get thrust limits
-        if (config.orient == "NED"):
-            # The Thrust limits are negated and swapped due to NED-frame
-            uMax = -quad.params["minThr"]
-            uMin = -quad.params["maxThr"]
-        elif (config.orient == "ENU"):
-            uMax = quad.params["maxThr"]
-            uMin = quad.params["minThr"]
-
-        # Apply Anti-Windup in D-direction
-        stop_int_D = (thrust_z_sp >= uMax and vel_z_error >= 0.0) or (thrust_z_sp <= uMin and vel_z_error <= 0.0)
-
-        # Calculate integral part
-        if not (stop_int_D):
-            self.thr_int[2] += self.vel_I_gain[2]*vel_z_error*Ts * quad.params["useIntergral"]
-            # Limit thrust integral
-            self.thr_int[2] = min(abs(self.thr_int[2]), quad.params["maxThr"])*np.sign(self.thr_int[2])
-
-        # Saturate thrust setpoint in D-direction
-        self.thrust_sp[2] = np.clip(thrust_z_sp, uMin, uMax)
+        self.thrust_sp[2] = ctrl_numba.z_vel_control(
+                self.vel_sp[2], quad.vel[2], quad.vel_dot[2], self.acc_sp[2],
+                quad.params["mB"], quad.params["g"], self.thr_int,
+                potfld.F_rep[2], potfld.pfSatFor,
+                self.vel_P_gain[2], self.vel_D_gain[2], self.vel_I_gain[2],
+                Ts, quad.params["useIntergral"],
+                quad.params["minThr"], quad.params["maxThr"],
+                self.orient_ned)
+
 
-    
     def xy_vel_control(self, quad, potfld, Ts):
-        
+
         # XY Velocity Control (Thrust in NE-direction)
         # ---------------------------
-        vel_xy_error = self.vel_sp[0:2] - quad.vel[0:2]
-        thrust_xy_sp = (self.vel_P_gain[0:2]*vel_xy_error - self.vel_D_gain[0:2]*quad.vel_dot[0:2] + 
-                    quad.params["mB"]*(self.acc_sp[0:2]) + self.thr_int[0:2] + 
-                    potfld.pfSatFor*potfld.F_rep[0:2])
-
-        # Max allowed thrust in NE based on tilt and excess thrust
-        thrust_max_xy_tilt = abs(self.thrust_sp[2])*np.tan(self.tiltMax)
-        thrust_max_xy = sqrt(quad.params["maxThr"]**2 - self.thrust_sp[2]**2)
-        thrust_max_xy = min(thrust_max_xy, thrust_max_xy_tilt)
-
-        # Saturate thrust in NE-direction
-        self.thrust_sp[0:2] = thrust_xy_sp
-        if (np.dot(self.thrust_sp[0:2].T, self.thrust_sp[0:2]) > thrust_max_xy**2):
-            mag = norm(self.thrust_sp[0:2])
-            self.thrust_sp[0:2] = thrust_xy_sp/mag*thrust_max_xy
-        
-        # Use tracking Anti-Windup for NE-direction: during saturation, the integrator is used to unsaturate the output
-        # see Anti-Reset Windup for PID controllers, L.Rundqwist, 1990
-        arw_gain = 2.0/self.vel_P_gain[0:2]
-        vel_err_lim = vel_xy_error - (thrust_xy_sp - self.thrust_sp[0:2])*arw_gain
-        self.thr_int[0:2] += self.vel_I_gain[0:2]*vel_err_lim*Ts * quad.params["useIntergral"]
-    
+        ctrl_numba.xy_vel_control(
+                self.vel_sp, quad.vel, quad.vel_dot, self.acc_sp,
+                quad.params["mB"], self.thr_int, potfld.F_rep, potfld.pfSatFor,
+                self.vel_P_gain, self.vel_D_gain, self.vel_I_gain,
+                Ts, quad.params["useIntergral"], self.maxThr_sq,
+                self.tan_tiltMax, self.thrust_sp)
+
 
     def thrustToAttitude(self, quad, potfld, Ts):
         # Create Full Desired Quaternion Based on Thrust Setpoint and Desired Yaw Angle
@@ -308,83 +304,34 @@ class Control:
         # Add potential field repulsive force to Thrust setpoint
         self.thrust_rep_sp = self.thrust_sp + potfld.pfFor*potfld.F_rep
 
-        # Yaw setpoint
-        yaw_sp = self.eul_sp[2]
+        # body_z (the normalized, orient-flipped thrust direction) is kept
+        # for attitude_control, which needs the exact same vector as e_z_d
+        self.qd_full, self.body_z = ctrl_numba.thrustToAttitude(self.thrust_rep_sp,
+                                                                self.eul_sp[2],
+                                                                self.orient_ned)
 
-        # Desired body_z axis direction
-        body_z = -utils.vectNormalize(self.thrust_rep_sp)
-        if (config.orient == "ENU"):
-            body_z = -body_z
-        
-        # Vector of desired Yaw direction in XY plane, rotated by pi/2 (fake body_y axis)
-        y_C = np.array([-sin(yaw_sp), cos(yaw_sp), 0.0])
-        
-        # Desired body_x axis direction
-        body_x = np.cross(y_C, body_z)
-        body_x = utils.vectNormalize(body_x)
-        
-        # Desired body_y axis direction
-        body_y = np.cross(body_z, body_x)
 
-        # Desired rotation matrix
-        R_sp = np.array([body_x, body_y, body_z]).T
-
-        # Full desired quaternion (full because it considers the desired Yaw angle)
-        self.qd_full = utils.RotToQuat(R_sp)
-        
-        
     def attitude_control(self, quad, Ts):
 
-        # Current thrust orientation e_z and desired thrust orientation e_z_d
-        e_z = quad.dcm[:,2]
-        e_z_d = -utils.vectNormalize(self.thrust_rep_sp)
-        if (config.orient == "ENU"):
-            e_z_d = -e_z_d
-
-        # Quaternion error between the 2 vectors
-        qe_red = np.zeros(4)
-        qe_red[0] = np.dot(e_z, e_z_d) + sqrt(norm(e_z)**2 * norm(e_z_d)**2)
-        qe_red[1:4] = np.cross(e_z, e_z_d)
-        qe_red = utils.vectNormalize(qe_red)
-        
-        # Reduced desired quaternion (reduced because it doesn't consider the desired Yaw angle)
-        self.qd_red = utils.quatMultiply(qe_red, quad.quat)
-
-        # Mixed desired quaternion (between reduced and full) and resulting desired quaternion qd
-        q_mix = utils.quatMultiply(utils.inverse(self.qd_red), self.qd_full)
-        q_mix = q_mix*np.sign(q_mix[0])
-        q_mix[0] = np.clip(q_mix[0], -1.0, 1.0)
-        q_mix[3] = np.clip(q_mix[3], -1.0, 1.0)
-        self.qd = utils.quatMultiply(self.qd_red, np.array([cos(self.yaw_w*np.arccos(q_mix[0])), 0, 0, sin(self.yaw_w*np.arcsin(q_mix[3]))]))
-
-        # Resulting error quaternion
-        self.qe = utils.quatMultiply(utils.inverse(quad.quat), self.qd)
-
-        # Create rate setpoint from quaternion error
-        self.rate_sp = (2.0*np.sign(self.qe[0])*self.qe[1:4])*self.att_P_gain
-        
-        # Limit yawFF
-        self.yawFF = np.clip(self.yawFF, -self.rateMax[2], self.rateMax[2])
-
-        # Add Yaw rate feed-forward
-        self.rate_sp += utils.quat2Dcm(utils.inverse(quad.quat))[:,2]*self.yawFF
-
-        # Limit rate setpoint
-        self.rate_sp = np.clip(self.rate_sp, -self.rateMax, self.rateMax)
+        self.qd, self.rate_sp, self.yawFF = ctrl_numba.attitude_control(
+                quad.dcm, quad.quat, self.body_z, self.qd_full,
+                self.yaw_w, self.att_P_gain, self.yawFF, self.rateMax)
 
 
     def rate_control(self, quad, Ts):
-        
+
         # Rate Control
         # ---------------------------
-        rate_error = self.rate_sp - quad.omega
-        self.rateCtrl = self.rate_P_gain*rate_error - self.rate_D_gain*quad.omega_dot     # Be sure it is right sign for the D part
+        self.rateCtrl = ctrl_numba.rate_control(self.rate_sp, quad.omega,
+                                                quad.omega_dot,
+                                                self.rate_P_gain, self.rate_D_gain)
         
 
     def setYawWeight(self):
         
         # Calculate weight of the Yaw control gain
         roll_pitch_gain = 0.5*(self.att_P_gain[0] + self.att_P_gain[1])
-        self.yaw_w = np.clip(self.att_P_gain[2]/roll_pitch_gain, 0.0, 1.0)
+        # min/max instead of np.clip: no ufunc dispatch for a plain scalar
+        self.yaw_w = min(1.0, max(0.0, self.att_P_gain[2]/roll_pitch_gain))
 
         self.att_P_gain[2] = roll_pitch_gain
@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""
+author: John Bass
+email: john.bobzwik@gmail.com
+license: MIT
+Please feel free to use and modify this, but keep the above information. Thanks!
+"""
+
+# Numba-compiled kernels for the Control hot path (see ctrl.py).
+# The per-step control pipeline runs at ~500-1000 Hz and used to spend most
+# of its time in numpy dispatch overhead on 3-vectors. These free functions
+# take plain float scalars/arrays and are compiled with numba, so the whole
+# cascaded-PID step runs as native code.
+
+import numpy as np
+from math import copysign
+
+try:
+    from numba import njit
+except ImportError:
+    # No numba available: fall back to running the kernels as plain Python.
+    # Much slower, but the simulation stays usable without any compiler
+    # toolchain or extra dependency. An AOT build (Cython/mypyc) was
+    # considered instead, but numba's cache=True already gives compiled-code
+    # startup after the first run without adding a build step to the repo.
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        def wrapper(func):
+            return func
+        return wrapper
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def _norm3(v):
+    return np.sqrt(v[0]*v[0] + v[1]*v[1] + v[2]*v[2])
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def _cross3(a, b):
+    # np.cross carries N-D/broadcasting machinery; on 3-vectors the
+    # explicit components are all that is needed
+    return np.array((a[1]*b[2] - a[2]*b[1],
+                     a[2]*b[0] - a[0]*b[2],
+                     a[0]*b[1] - a[1]*b[0]))
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def _norm4(v):
+    return np.sqrt(v[0]*v[0] + v[1]*v[1] + v[2]*v[2] + v[3]*v[3])
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def quatMultiply(q, p):
+    # Hamilton product written out component-wise: no 4x4 temporary and
+    # no matrix-vector dispatch
+    return np.array((q[0]*p[0] - q[1]*p[1] - q[2]*p[2] - q[3]*p[3],
+                     q[1]*p[0] + q[0]*p[1] - q[3]*p[2] + q[2]*p[3],
+                     q[2]*p[0] + q[3]*p[1] + q[0]*p[2] - q[1]*p[3],
+                     q[3]*p[0] - q[2]*p[1] + q[1]*p[2] + q[0]*p[3]))
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def quatInverse(q):
+    return np.array((q[0], -q[1], -q[2], -q[3]))/_norm4(q)
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def quat2Dcm(q):
+    dcm = np.zeros((3,3))
+
+    dcm[0,0] = q[0]**2 + q[1]**2 - q[2]**2 - q[3]**2
+    dcm[0,1] = 2.0*(q[1]*q[2] - q[0]*q[3])
+    dcm[0,2] = 2.0*(q[1]*q[3] + q[0]*q[2])
+    dcm[1,0] = 2.0*(q[1]*q[2] + q[0]*q[3])
+    dcm[1,1] = q[0]**2 - q[1]**2 + q[2]**2 - q[3]**2
+    dcm[1,2] = 2.0*(q[2]*q[3] - q[0]*q[1])
+    dcm[2,0] = 2.0*(q[1]*q[3] - q[0]*q[2])
+    dcm[2,1] = 2.0*(q[2]*q[3] + q[0]*q[1])
+    dcm[2,2] = q[0]**2 - q[1]**2 - q[2]**2 + q[3]**2
+
+    return dcm
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def RotToQuat(R):
+
+    R11 = R[0, 0]
+    R12 = R[0, 1]
+    R13 = R[0, 2]
+    R21 = R[1, 0]
+    R22 = R[1, 1]
+    R23 = R[1, 2]
+    R31 = R[2, 0]
+    R32 = R[2, 1]
+    R33 = R[2, 2]
+    # From page 68 of MotionGenesis book
+    tr = R11 + R22 + R33
+
+    if tr > R11 and tr > R22 and tr > R33:
+        e0 = 0.5 * np.sqrt(1 + tr)
+        r = 0.25 / e0
+        e1 = (R32 - R23) * r
+        e2 = (R13 - R31) * r
+        e3 = (R21 - R12) * r
+    elif R11 > R22 and R11 > R33:
+        e1 = 0.5 * np.sqrt(1 - tr + 2*R11)
+        r = 0.25 / e1
+        e0 = (R32 - R23) * r
+        e2 = (R12 + R21) * r
+        e3 = (R13 + R31) * r
+    elif R22 > R33:
+        e2 = 0.5 * np.sqrt(1 - tr + 2*R22)
+        r = 0.25 / e2
+        e0 = (R13 - R31) * r
+        e1 = (R12 + R21) * r
+        e3 = (R23 + R32) * r
+    else:
+        e3 = 0.5 * np.sqrt(1 - tr + 2*R33)
+        r = 0.25 / e3
+        e0 = (R21 - R12) * r
+        e1 = (R13 + R31) * r
+        e2 = (R23 + R32) * r
+
+    # e0,e1,e2,e3 = qw,qx,qy,qz
+    q = np.array((e0,e1,e2,e3))
+    q = q*copysign(1.0, e0)
+
+    q = q/np.sqrt(q[0]**2 + q[1]**2 + q[2]**2 + q[3]**2)
+
+    return q
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def saturateVel(vel_sp, velMax, velMaxAll, saturateVel_separately):
+
+    # Saturate Velocity Setpoint
+    # ---------------------------
+    # Either saturate each velocity axis separately, or total velocity (prefered)
+    if saturateVel_separately:
+        for i in range(3):
+            vel_sp[i] = min(velMax[i], max(-velMax[i], vel_sp[i]))
+    else:
+        totalVel_sp = _norm3(vel_sp)
+        if (totalVel_sp > velMaxAll):
+            scale = velMaxAll/totalVel_sp
+            vel_sp[0] *= scale
+            vel_sp[1] *= scale
+            vel_sp[2] *= scale
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def z_vel_control(vel_sp_z, vel_z, vel_dot_z, acc_sp_z, mB, g, thr_int, F_rep_z,
+                  pfSatFor, Pz, Dz, Iz, Ts, useI, minThr, maxThr, orient_ned):
+
+    # Z Velocity Control (Thrust in D-direction)
+    # ---------------------------
+    # Hover thrust (m*g) is sent as a Feed-Forward term, in order to
+    # allow hover when the position and velocity error are nul
+    vel_z_error = vel_sp_z - vel_z
+    if orient_ned:
+        thrust_z_sp = (Pz*vel_z_error - Dz*vel_dot_z + mB*(acc_sp_z - g) +
+                       thr_int[2] + pfSatFor*F_rep_z)
+        # The Thrust limits are negated and swapped due to NED-frame
+        uMax = -minThr
+        uMin = -maxThr
+    else:
+        thrust_z_sp = (Pz*vel_z_error - Dz*vel_dot_z + mB*(acc_sp_z + g) +
+                       thr_int[2] + pfSatFor*F_rep_z)
+        uMax = maxThr
+        uMin = minThr
+
+    # Apply Anti-Windup in D-direction
+    stop_int_D = (thrust_z_sp >= uMax and vel_z_error >= 0.0) or (thrust_z_sp <= uMin and vel_z_error <= 0.0)
+
+    # Calculate integral part
+    if not (stop_int_D):
+        thr_int[2] += Iz*vel_z_error*Ts * useI
+        # Limit thrust integral
+        thr_int[2] = copysign(min(abs(thr_int[2]), maxThr), thr_int[2])
+
+    # Saturate thrust setpoint in D-direction
+    return min(uMax, max(uMin, thrust_z_sp))
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def xy_vel_control(vel_sp, vel, vel_dot, acc_sp, mB, thr_int, F_rep,
+                   pfSatFor, vel_P_gain, vel_D_gain, vel_I_gain, Ts, useI,
+                   maxThr_sq, tan_tiltMax, thrust_sp):
+
+    # XY Velocity Control (Thrust in NE-direction), fused into scalar
+    # expressions per axis: no 2-element temporaries
+    # ---------------------------
+    vel_x_error = vel_sp[0] - vel[0]
+    vel_y_error = vel_sp[1] - vel[1]
+    tx = (vel_P_gain[0]*vel_x_error - vel_D_gain[0]*vel_dot[0] +
+          mB*acc_sp[0] + thr_int[0] + pfSatFor*F_rep[0])
+    ty = (vel_P_gain[1]*vel_y_error - vel_D_gain[1]*vel_dot[1] +
+          mB*acc_sp[1] + thr_int[1] + pfSatFor*F_rep[1])
+
+    # Max allowed thrust in NE based on tilt and excess thrust
+    # (tan(tiltMax) and maxThr**2 are hoisted to Control.__init__)
+    thrust_max_xy_tilt = abs(thrust_sp[2])*tan_tiltMax
+    thrust_max_xy = np.sqrt(maxThr_sq - thrust_sp[2]**2)
+    thrust_max_xy = min(thrust_max_xy, thrust_max_xy_tilt)
+
+    # Saturate thrust in NE-direction, comparing squared magnitudes so the
+    # sqrt is only taken when the setpoint actually saturates
+    thrust_sp[0] = tx
+    thrust_sp[1] = ty
+    sq = tx*tx + ty*ty
+    if (sq > thrust_max_xy*thrust_max_xy):
+        mag = np.sqrt(sq)
+        thrust_sp[0] = tx/mag*thrust_max_xy
+        thrust_sp[1] = ty/mag*thrust_max_xy
+
+    # Use tracking Anti-Windup for NE-direction: during saturation, the integrator is used to unsaturate the output
+    # see Anti-Reset Windup for PID controllers, L.Rundqwist, 1990
+    vel_err_lim_x = vel_x_error - (tx - thrust_sp[0])*(2.0/vel_P_gain[0])
+    vel_err_lim_y = vel_y_error - (ty - thrust_sp[1])*(2.0/vel_P_gain[1])
+    thr_int[0] += vel_I_gain[0]*vel_err_lim_x*Ts * useI
+    thr_int[1] += vel_I_gain[1]*vel_err_lim_y*Ts * useI
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def thrustToAttitude(thrust_rep_sp, yaw_sp, orient_ned):
+    # Create Full Desired Quaternion Based on Thrust Setpoint and Desired Yaw Angle
+    # ---------------------------
+
+    # Desired body_z axis direction
+    body_z = -thrust_rep_sp/_norm3(thrust_rep_sp)
+    if not orient_ned:
+        body_z = -body_z
+
+    # Vector of desired Yaw direction in XY plane, rotated by pi/2 (fake body_y axis)
+    y_C = np.array((-np.sin(yaw_sp), np.cos(yaw_sp), 0.0))
+
+    # Desired body_x axis direction
+    body_x = _cross3(y_C, body_z)
+    body_x = body_x/_norm3(body_x)
+
+    # Desired body_y axis direction
+    body_y = _cross3(body_z, body_x)
+
+    # Desired rotation matrix, filled column by column (no stacked
+    # temporary + transposed view to re-materialize)
+    R_sp = np.empty((3,3))
+    R_sp[:,0] = body_x
+    R_sp[:,1] = body_y
+    R_sp[:,2] = body_z
+
+    # Full desired quaternion (full because it considers the desired Yaw
+    # angle). body_z is returned as well: it is the same normalized thrust
+    # direction attitude_control needs as e_z_d, so it is computed once
+    return RotToQuat(R_sp), body_z
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def attitude_control(dcm, quat, e_z_d, qd_full, yaw_w, att_P_gain,
+                     yawFF, rateMax):
+
+    # Current thrust orientation e_z and desired thrust orientation e_z_d
+    # (e_z_d is body_z from thrustToAttitude, already normalized and
+    # orient-flipped)
+    ezx = dcm[0,2]
+    ezy = dcm[1,2]
+    ezz = dcm[2,2]
+    edx = e_z_d[0]
+    edy = e_z_d[1]
+    edz = e_z_d[2]
+
+    # Quaternion error between the 2 vectors, fused into scalar math:
+    # w = dot(e_z, e_z_d) + |e_z||e_z_d|, vector part = cross(e_z, e_z_d),
+    # then normalize
+    w  = (ezx*edx + ezy*edy + ezz*edz +
+          np.sqrt((ezx*ezx + ezy*ezy + ezz*ezz)*(edx*edx + edy*edy + edz*edz)))
+    cx = ezy*edz - ezz*edy
+    cy = ezz*edx - ezx*edz
+    cz = ezx*edy - ezy*edx
+    inv = 1.0/np.sqrt(w*w + cx*cx + cy*cy + cz*cz)
+    qe_red = np.array((w*inv, cx*inv, cy*inv, cz*inv))
+
+    # Reduced desired quaternion (reduced because it doesn't consider the desired Yaw angle)
+    qd_red = quatMultiply(qe_red, quat)
+
+    # Mixed desired quaternion (between reduced and full) and resulting desired quaternion qd
+    q_mix = quatMultiply(quatInverse(qd_red), qd_full)
+    q_mix = q_mix*copysign(1.0, q_mix[0])
+    q_mix[0] = min(1.0, max(-1.0, q_mix[0]))
+    q_mix[3] = min(1.0, max(-1.0, q_mix[3]))
+    qd = quatMultiply(qd_red, np.array((np.cos(yaw_w*np.arccos(q_mix[0])), 0.0, 0.0, np.sin(yaw_w*np.arcsin(q_mix[3])))))
+
+    # Resulting error quaternion
+    qe = quatMultiply(quatInverse(quat), qd)
+
+    # Create rate setpoint from quaternion error
+    rate_sp = (copysign(2.0, qe[0])*qe[1:4])*att_P_gain
+
+    # Limit yawFF
+    yawFF = min(rateMax[2], max(-rateMax[2], yawFF))
+
+    # Add Yaw rate feed-forward. For a unit quaternion
+    # quat2Dcm(inverse(quat)) == quat2Dcm(quat).T, so the third column of
+    # the inverse DCM is just the third row of the DCM the quad already
+    # carries
+    rate_sp[0] += dcm[2,0]*yawFF
+    rate_sp[1] += dcm[2,1]*yawFF
+    rate_sp[2] += dcm[2,2]*yawFF
+
+    # Limit rate setpoint
+    for i in range(3):
+        rate_sp[i] = min(rateMax[i], max(-rateMax[i], rate_sp[i]))
+
+    return qd, rate_sp, yawFF
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def rate_control(rate_sp, omega, omega_dot, rate_P_gain, rate_D_gain):
+
+    # Rate Control
+    # ---------------------------
+    rate_error = rate_sp - omega
+    return rate_P_gain*rate_error - rate_D_gain*omega_dot     # Be sure it is right sign for the D part
+
+
+def warmup():
+    # Trigger the (cached) numba compilation once, outside the simulation
+    # loop, so the first controller call doesn't pay the JIT cost
+    vec3  = np.array([0.1, 0.2, -1.0])
+    vec4  = np.array([1.0, 0.0, 0.0, 0.0])
+    gains = np.array([1.0, 1.0, 1.0])
+    dcm   = quat2Dcm(vec4)
+
+    saturateVel(vec3.copy(), gains, 1.0, False)
+    z_vel_control(0.1, 0.0, 0.0, 0.0, 1.0, 9.81, vec3.copy(), 0.0,
+                  0, 1.0, 1.0, 1.0, 0.005, True, 0.1, 10.0, True)
+    xy_vel_control(vec3, vec3, vec3, vec3, 1.0, vec3.copy(), vec3,
+                   0, gains, gains, gains, 0.005, True, 10.0, 0.5, vec3.copy())
+    qd_full, body_z = thrustToAttitude(vec3, 0.1, True)
+    attitude_control(dcm, vec4, body_z, qd_full, 0.5, gains, 0.1, gains)
+    rate_control(vec3, vec3, vec3, gains, gains)
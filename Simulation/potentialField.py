@@ -45,7 +45,14 @@ class PotField:
         elif (pfType == 3):
             self.pfFor = 1
 
-    
+
+    def reset(self):
+        # Clear the per-iteration outputs so a single PotField instance can
+        # be reused across simulation steps instead of being rebuilt
+        # ---------------------------
+        self.F_rep = np.zeros(3)
+        self.fieldPointcloud = self.pointcloud[0:0]
+
     def isWithinRange(self, quad):
         # Determine which points are withing a certain range
         # to avoid computing things that are too far
@@ -31,7 +31,7 @@ def makeWaypoints(init_pose, wp, yaw, total_time=5):
     # For pos_waypoint_arrived_wait, this time will be the 
     # amount of time waiting
     t = np.linspace(0, total_time, wp.shape[0])
-    dist = np.sum([((i-e)**2)**0.5 for i,e in zip(wp[:-1],wp[1:])])
+    dist = np.abs(np.diff(wp, axis=0)).sum()
     v_average = dist/total_time
 
     return t, wp, yaw, v_average
@@ -136,38 +136,40 @@ def main():
     
     # Initialize Result Matrixes
     # ---------------------------
+    # Pre-allocated and indexed by i: appending to Python lists and
+    # converting with np.asanyarray at the end costs more and copies twice
     numTimeStep = int(Tf/Ts+1)
 
-    t_all          = []
-    s_all          = []
-    pos_all        = []
-    vel_all        = []
-    quat_all       = []
-    omega_all      = []
-    euler_all      = []
-    sDes_traj_all  = []
-    sDes_calc_all  = []
-    w_cmd_all      = []
-    wMotor_all     = []
-    thr_all        = []
-    tor_all        = []
-    potfld_all     = []
-    fieldPointcloud = []
-
-    t_all.append(Ti)
-    s_all.append(quad.state)
-    pos_all.append(quad.pos)
-    vel_all.append(quad.vel)
-    quat_all.append(quad.quat)
-    omega_all.append(quad.omega)
-    euler_all.append(quad.euler)
-    sDes_traj_all.append(traj.sDes)
-    sDes_calc_all.append(ctrl.sDesCalc)
-    w_cmd_all.append(ctrl.w_cmd)
-    wMotor_all.append(quad.wMotor)
-    thr_all.append(quad.thr)
-    tor_all.append(quad.tor)
-    potfld_all.append(potfld.F_rep)
+    t_all          = np.empty(numTimeStep)
+    s_all          = np.empty((numTimeStep, len(quad.state)))
+    pos_all        = np.empty((numTimeStep, 3))
+    vel_all        = np.empty((numTimeStep, 3))
+    quat_all       = np.empty((numTimeStep, 4))
+    omega_all      = np.empty((numTimeStep, 3))
+    euler_all      = np.empty((numTimeStep, 3))
+    sDes_traj_all  = np.empty((numTimeStep, len(traj.sDes)))
+    sDes_calc_all  = np.empty((numTimeStep, len(ctrl.sDesCalc)))
+    w_cmd_all      = np.empty((numTimeStep, 4))
+    wMotor_all     = np.empty((numTimeStep, 4))
+    thr_all        = np.empty((numTimeStep, 4))
+    tor_all        = np.empty((numTimeStep, 4))
+    potfld_all     = np.empty((numTimeStep, 3))
+    fieldPointcloud = []    # stays a list, one ragged array per timestep
+
+    t_all[0]         = Ti
+    s_all[0]         = quad.state
+    pos_all[0]       = quad.pos
+    vel_all[0]       = quad.vel
+    quat_all[0]      = quad.quat
+    omega_all[0]     = quad.omega
+    euler_all[0]     = quad.euler
+    sDes_traj_all[0] = traj.sDes
+    sDes_calc_all[0] = ctrl.sDesCalc
+    w_cmd_all[0]     = ctrl.w_cmd
+    wMotor_all[0]    = quad.wMotor
+    thr_all[0]       = quad.thr
+    tor_all[0]       = quad.tor
+    potfld_all[0]    = potfld.F_rep
     fieldPointcloud.append(potfld.fieldPointcloud)
 
     wall = np.random.rand(500,3)
@@ -175,34 +177,48 @@ def main():
     wall[:,1] = 0
     wall[:,2] = -wall[:,2]*5
 
+    # The pointcloud is fixed, so the potential field is built once and
+    # only reset/reevaluated inside the loop
+    potfld = PotField(pfType=1, importedData=wall, rangeRadius=5, fieldRadius=3, kF=1)
+
     # Run Simulation
     # ---------------------------
     t = Ti
     i = 1
     start_time = time.time()
-    while (round(t,3) < Tf) and (i < numTimeStep) and not (all(traj.desPos == traj.wps[-1,:]) and sum(abs(traj.wps[-1,:]-quad.pos)) <= traj.dist_consider_arrived):
+
+    # Scalar termination test (cached last waypoint, no temporary arrays)
+    wp_last = traj.wps[-1]
+    def last_wp_reached():
+        return ((traj.desPos[0] == wp_last[0]) and
+                (traj.desPos[1] == wp_last[1]) and
+                (traj.desPos[2] == wp_last[2]) and
+                (abs(wp_last[0]-quad.pos[0]) + abs(wp_last[1]-quad.pos[1]) +
+                 abs(wp_last[2]-quad.pos[2])) <= traj.dist_consider_arrived)
+
+    while (t < Tf) and (i < numTimeStep) and not last_wp_reached():
         t_ini = time.monotonic()
-        potfld = PotField(pfType=1, importedData=wall, rangeRadius=5, fieldRadius=3, kF=1)
+        potfld.reset()
         potfld.isWithinRange(quad)
         potfld.isWithinField(quad)        
         potfld.rep_force(quad, traj)
         t = quad_sim(t, Ts, quad, ctrl, wind, traj, potfld)
         
         # print("{:.3f}".format(t))
-        t_all.append(t)
-        s_all.append(quad.state)
-        pos_all.append(quad.pos)
-        vel_all.append(quad.vel)
-        quat_all.append(quad.quat)
-        omega_all.append(quad.omega)
-        euler_all.append(quad.euler)
-        sDes_traj_all.append(traj.sDes)
-        sDes_calc_all.append(ctrl.sDesCalc)
-        w_cmd_all.append(ctrl.w_cmd)
-        wMotor_all.append(quad.wMotor)
-        thr_all.append(quad.thr)
-        tor_all.append(quad.tor)
-        potfld_all.append(potfld.F_rep)
+        t_all[i]         = t
+        s_all[i]         = quad.state
+        pos_all[i]       = quad.pos
+        vel_all[i]       = quad.vel
+        quat_all[i]      = quad.quat
+        omega_all[i]     = quad.omega
+        euler_all[i]     = quad.euler
+        sDes_traj_all[i] = traj.sDes
+        sDes_calc_all[i] = ctrl.sDesCalc
+        w_cmd_all[i]     = ctrl.w_cmd
+        wMotor_all[i]    = quad.wMotor
+        thr_all[i]       = quad.thr
+        tor_all[i]       = quad.tor
+        potfld_all[i]    = potfld.F_rep
         fieldPointcloud.append(potfld.fieldPointcloud)
         
         i += 1
@@ -214,20 +230,21 @@ def main():
     # View Results
     # ---------------------------
 
-    t_all = np.asanyarray(t_all)
-    s_all = np.asanyarray(s_all)
-    pos_all = np.asanyarray(pos_all)
-    vel_all = np.asanyarray(vel_all)
-    quat_all = np.asanyarray(quat_all)
-    omega_all = np.asanyarray(omega_all)
-    euler_all = np.asanyarray(euler_all)
-    sDes_traj_all = np.asanyarray(sDes_traj_all)
-    sDes_calc_all = np.asanyarray(sDes_calc_all)
-    w_cmd_all = np.asanyarray(w_cmd_all)
-    wMotor_all = np.asanyarray(wMotor_all)
-    thr_all = np.asanyarray(thr_all)
-    tor_all = np.asanyarray(tor_all)
-    potfld_all = np.asanyarray(potfld_all)
+    # Drop the unused part of the arrays if the loop exited early
+    t_all = t_all[:i]
+    s_all = s_all[:i]
+    pos_all = pos_all[:i]
+    vel_all = vel_all[:i]
+    quat_all = quat_all[:i]
+    omega_all = omega_all[:i]
+    euler_all = euler_all[:i]
+    sDes_traj_all = sDes_traj_all[:i]
+    sDes_calc_all = sDes_calc_all[:i]
+    w_cmd_all = w_cmd_all[:i]
+    wMotor_all = wMotor_all[:i]
+    thr_all = thr_all[:i]
+    tor_all = tor_all[:i]
+    potfld_all = potfld_all[:i]
     fieldPointcloud = np.array(fieldPointcloud, dtype=object)
 
     # utils.fullprint(sDes_traj_all[:,3:6])